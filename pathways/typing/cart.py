@@ -2,13 +2,20 @@
 
 from __future__ import annotations
 
+import sys
 from dataclasses import dataclass
+from functools import partial
+from itertools import compress
+from operator import eq
 from typing import Any, Literal
 
 Operator = Literal[">", "<", "in"]
 
+# comparison operator for continuous variables, indexed by the sign of `ncat`
+NCAT_OPERATORS: dict[int, Operator] = {-1: "<", 1: ">"}
 
-@dataclass
+
+@dataclass(slots=True)
 class CARTRule:
     """A split rule in a CART model."""
 
@@ -21,7 +28,7 @@ class CARTRule:
         return f"CARTRule(var={self.var}, operator={self.operator}, value={self.value})"
 
 
-@dataclass
+@dataclass(slots=True)
 class CARTNode:
     """A CART node (split node or leaf)."""
 
@@ -60,18 +67,13 @@ def get_categorical_values(
     - 2: value is not present at the node
     - 3: value leads to the right child
     """
-    left = []
-    right = []
-    not_present = []
-
-    for i, code in enumerate(csplit[csplit_id - 1]):
-        if code == 1:
-            left.append(xlevels[i])
-        elif code == 2:
-            if len(xlevels) > i:
-                not_present.append(xlevels[i])
-        elif code == 3:
-            right.append(xlevels[i])
+    row = csplit[csplit_id - 1]
+
+    # rows of the `csplit` matrix are padded to the largest number of levels across variables:
+    # `compress` stops at the end of `xlevels` and ignores the padding
+    left = list(compress(xlevels, map(partial(eq, 1), row)))
+    right = list(compress(xlevels, map(partial(eq, 3), row)))
+    not_present = list(compress(xlevels, map(partial(eq, 2), row)))
 
     return left, right, not_present
 
@@ -83,11 +85,7 @@ def get_operator(ncat: int) -> Operator:
     For continuous variables, `ncat` is either 1 or -1. In that case, the sign
     of `ncat` determines the comparison operator.
     """
-    if ncat == -1:
-        return "<"
-    if ncat == 1:
-        return ">"
-    return "in"
+    return NCAT_OPERATORS.get(ncat, "in")
 
 
 def get_rules(
@@ -142,11 +140,8 @@ def get_counts(yval2: list[int | float], ylevels: list[str]) -> dict[str, int]:
     Cluster counts are stored after the 1st element in the yval2 array (with one
     value per cluster).
     """
-    counts = {}
-    for i in range(len(ylevels)):
-        cluster = ylevels[i]
-        counts[cluster] = yval2[i + 1]
-    return counts
+    n = len(ylevels)
+    return dict(zip(ylevels, yval2[1 : 1 + n]))
 
 
 def get_probs(yval2: list[int | float], ylevels: list[str]) -> dict[str, float]:
@@ -155,29 +150,34 @@ def get_probs(yval2: list[int | float], ylevels: list[str]) -> dict[str, float]:
     Cluster probabilities are stored after the cluster counts in the yval2 array
     (with one value per cluster).
     """
-    probs = {}
-    for i in range(len(ylevels)):
-        cluster = ylevels[i]
-        probs[cluster] = yval2[i + 1 + len(ylevels)]
-    return probs
+    n = len(ylevels)
+    return dict(zip(ylevels, yval2[1 + n : 1 + 2 * n]))
 
 
 def parse_nodes(cart: dict[str, Any]) -> dict[int, CARTNode]:
     """Parse CART nodes from the CART JSON output."""
     cart_nodes = {}
 
+    # shared by all nodes of the tree
+    # cluster and variable names are repeated across nodes and are used as dict keys: intern them
+    # so that all nodes share the same string objects
+    ylevels = [sys.intern(level) for level in cart["ylevels"]]
+    xlevels = cart["xlevels"]
+    csplit = cart["csplit"]
+
     for node in cart["nodes"]:
-        cluster_name = cart["ylevels"][int(node["yval"]) - 1]
-        counts = get_counts(node["yval2"], cart["ylevels"])
-        cluster_probabilities = get_probs(node["yval2"], cart["ylevels"])
+        var = sys.intern(node["var"])
+        yval2 = node["yval2"]
 
-        if node["var"] != "<leaf>":
+        # rpart uses the "<leaf>" value to indicate that a node doesn't have any
+        # split rule (i.e., it's a leaf)
+        if var != "<leaf>":
             left, right = get_rules(
-                var=node["var"],
+                var=var,
                 ncat=node["ncat"],
                 index=node["index"],
-                xlevels=cart["xlevels"].get(node["var"]),
-                csplit=cart["csplit"],
+                xlevels=xlevels.get(var),
+                csplit=csplit,
             )
 
         else:
@@ -185,13 +185,13 @@ def parse_nodes(cart: dict[str, Any]) -> dict[int, CARTNode]:
 
         n = CARTNode(
             index=int(node["node"]),
-            cluster=cluster_name,
-            counts=counts,
-            cluster_probabilities=cluster_probabilities,
-            node_probability=node["yval2"][-1],
+            cluster=ylevels[int(node["yval"]) - 1],
+            counts=get_counts(yval2, ylevels),
+            cluster_probabilities=get_probs(yval2, ylevels),
+            node_probability=yval2[-1],
             left=left,
             right=right,
-            var=node["var"],
+            var=var,
         )
 
         cart_nodes[n.index] = n
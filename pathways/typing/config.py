@@ -1,11 +1,24 @@
 """Read configuration from a google spreadsheet."""
 
+from collections import Counter
 from pathlib import Path
 
-import gspread
 import polars as pl
 import yaml
-from oauth2client.service_account import ServiceAccountCredentials
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+CONFIG_WORKSHEETS = ("questions", "choices", "options", "settings", "screening", "segments")
+
+GOOGLE_SCOPE = (
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive",
+)
 
 
 def read_excel_spreadsheet(fp: Path) -> pl.DataFrame:
@@ -41,31 +54,74 @@ def read_google_spreadsheet(url: str, credentials: dict) -> dict:
     dict
         Configuration data with worksheet title as key and worksheet content as value
     """
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive.file",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials, scope)
+    # google client libraries are slow to import and only needed here
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials, list(GOOGLE_SCOPE))
     client = gspread.authorize(creds)
     spreadsheet = client.open_by_url(url)
 
+    titles = [
+        worksheet.title
+        for worksheet in spreadsheet.worksheets()
+        if worksheet.title in CONFIG_WORKSHEETS
+    ]
+    if not titles:
+        return {}
+
+    # fetch all worksheets in a single API call
+    response = spreadsheet.values_batch_get(ranges=[f"'{title}'" for title in titles])
+
     data = {}
-    for worksheet in spreadsheet.worksheets():
-        if worksheet.title in [
-            "questions",
-            "choices",
-            "options",
-            "settings",
-            "screening",
-            "segments",
-        ]:
-            data[worksheet.title] = worksheet.get_all_records(head=2)
+    for title, value_range in zip(titles, response["valueRanges"]):
+        data[title] = get_records(value_range.get("values", []), head=2)
 
     return data
 
 
+def get_records(values: list[list], head: int = 1) -> list[dict]:
+    """Convert worksheet values to records, as `gspread.Worksheet.get_all_records()` would.
+
+    Parameters
+    ----------
+    values : list[list]
+        Worksheet values (one list per row) as returned by the Sheets API
+    head : int, optional
+        Row number of the header row (1-indexed)
+
+    Returns
+    -------
+    list[dict]
+        One dict per row below the header, with header values as keys
+
+    Raises
+    ------
+    GSpreadException
+        If the header row contains duplicates
+    """
+    from gspread.exceptions import GSpreadException
+    from gspread.utils import numericise_all
+
+    if len(values) < head:
+        return []
+
+    # the API omits trailing empty cells: pad all rows to the same width
+    width = max(len(row) for row in values)
+    header = values[head - 1] + [""] * (width - len(values[head - 1]))
+
+    # duplicate columns would silently overwrite each other in the records
+    counts = Counter(header)
+    duplicates = [column for column, count in counts.items() if count > 1]
+    if duplicates:
+        msg = f"the header row in the worksheet contains duplicates: {duplicates}"
+        raise GSpreadException(msg)
+
+    return [
+        dict(zip(header, numericise_all(row + [""] * (width - len(row))))) for row in values[head:]
+    ]
+
+
 def get_questions_config(rows: list[dict]) -> dict:
     """Get questions from the configuration spreadsheet.
 
@@ -79,10 +135,7 @@ def get_questions_config(rows: list[dict]) -> dict:
     dict
         Questions config with question id as keys
     """
-    questions_config = {}
-    for question in rows:
-        questions_config[question["question_name"]] = question
-    return questions_config
+    return {question["question_name"]: question for question in rows}
 
 
 def get_choices_config(rows: list[dict]) -> dict:
@@ -122,7 +175,7 @@ def get_options_config(rows: list[dict]) -> list[dict]:
     """
     options_config = []
     for option in rows:
-        option["config"] = yaml.safe_load(option["config"])
+        option["config"] = yaml.load(option["config"], Loader=YamlLoader)
         options_config.append(option)
     return options_config
 
@@ -142,12 +195,7 @@ def get_segments_config(rows: list[dict]) -> dict:
     """
     segments_config = {}
     for row in rows:
-        strata = row["strata"]
-        cluster = row["cluster"]
-        segment = row["segment"]
-        if strata not in segments_config:
-            segments_config[strata] = {}
-        segments_config[strata][cluster] = segment
+        segments_config.setdefault(row["strata"], {})[row["cluster"]] = row["segment"]
     return segments_config
 
 
@@ -164,7 +212,4 @@ def get_settings(rows: list[dict]) -> dict:
     dict
         Key:value settings as a dict
     """
-    settings_config = {}
-    for row in rows:
-        settings_config[row["key"]] = row["value"]
-    return settings_config
+    return {row["key"]: row["value"] for row in rows}
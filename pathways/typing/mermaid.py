@@ -9,45 +9,61 @@ Notes
       feature.
 """
 
+import io
+import re
+from functools import lru_cache
 from typing import Literal
 
 from .exceptions import MermaidError
-from .tree import Node, filter_choices
+from .tree import Node, filter_choices, normalize_var
 
 ShapeType = Literal[
     "rectangle",
+    "round_edges",
     "stadium",
     "hexagon",
     "parallelogram",
-    "prallelogram_alt",
+    "parallelogram_alt",
     "circle",
     "trapezoid",
     "trapezoid_alt",
     "rhombus",
 ]
 
-
+# opening and closing delimiters of each shape type
+SHAPES: dict[ShapeType, tuple[str, str]] = {
+    "rectangle": ("[", "]"),
+    "round_edges": ("(", ")"),
+    "stadium": ("([", "])"),
+    "circle": ("((", "))"),
+    "hexagon": ("{{", "}}"),
+    "parallelogram": ("[/", "/]"),
+    "parallelogram_alt": ("[\\", "\\]"),
+    "trapezoid": ("[/", "\\]"),
+    "trapezoid_alt": ("[\\", "/]"),
+    "rhombus": ("{", "}"),
+}
+
+# brackets break whimsical import, and line breaks must be escaped
+LABEL_TRANSLATION = str.maketrans({"(": " ", ")": " ", "[": " ", "]": " ", "\n": "\\n"})
+UNSAFE_LABEL_CHARS = re.compile(r"[()\[\]\n]")
+
+
+@lru_cache(maxsize=4096)
 def clean_label(label: str) -> str:
-    """Clean label string to not break whimsical import."""
-    for char in ["(", ")", "[", "]"]:
-        label = label.replace(char, " ")
-    return label.replace("\n", "\\n")
+    """Clean label string to not break whimsical import.
+
+    Cached as the same choice and question labels are drawn on many shapes and links.
+    """
+    # most labels do not contain any unsafe character: skip building a new string
+    if UNSAFE_LABEL_CHARS.search(label) is None:
+        return label
+    return label.translate(LABEL_TRANSLATION)
 
 
 def draw_shape(shape_id: str, label: str, shape_type: ShapeType = "rectangle") -> str:
     """Print mermaid shape."""
-    shapes = {
-        "rectangle": ("[", "]"),
-        "stadium": ("([", "])"),
-        "circle": ("((", "))"),
-        "hexagon": ("{{", "}}"),
-        "parallelogram": ("[/", "/]"),
-        "parallelogram_alt": ("[\\", "\\]"),
-        "trapezoid": ("[/", "\\]"),
-        "trapezoid_alt": ("[\\", "/]"),
-        "rhombus": ("{", "}"),
-    }
-    begin, end = shapes[shape_type]
+    begin, end = SHAPES[shape_type]
     label = clean_label(label)
     return f"{shape_id}{begin}{label}{end}"
 
@@ -75,7 +91,10 @@ def create_cart_diagram(root: Node) -> str:
     """Create mermaid diagram for CART."""
     header = "flowchart TD"
 
-    shapes_lst = []
+    # shapes must be declared before links: write them to separate buffers
+    shapes = io.StringIO()
+    shapes.write(header)
+    links = io.StringIO()
     for node in root.preorder():
         if node.is_leaf:
             label = node.cart.cluster
@@ -83,17 +102,15 @@ def create_cart_diagram(root: Node) -> str:
         else:
             label = node.cart.left.var
             shape_type = "rectangle"
-        shape = draw_shape(node.uid, label, shape_type)
-        shapes_lst.append(shape)
+        shapes.write("\n\t")
+        shapes.write(draw_shape(node.uid, label, shape_type))
 
-    links = []
-    for node in root.preorder():
         if node.is_root:
             continue
-        link = draw_link(node.parent.uid, node.uid, _link_label(node))
-        links.append(link)
+        links.write("\n\t")
+        links.write(draw_link(node.parent.uid, node.uid, _link_label(node)))
 
-    return "\n\t".join([header, *shapes_lst, *links])
+    return shapes.getvalue() + links.getvalue()
 
 
 def get_form_shape_label(node: Node, language: str = "English (en)") -> str:
@@ -109,56 +126,65 @@ def get_form_shape_label(node: Node, language: str = "English (en)") -> str:
 def get_form_link_label(node: Node, language: str = "English (en)") -> str:
     """Get label for form link between current node and its parent."""
     if node.question.choices_from_parent:
-        choices = [
-            choice.label[f"label::{language}"] for choice in node.question.choices_from_parent
-        ]
+        column = f"label::{language}"
+        choices = [choice.label[column] for choice in node.question.choices_from_parent]
         return ", ".join(choices)
 
-    if node.parent.question.type == "calculate" and node.cart_rule:
-        for parent in node.parents:
-            if parent.name == node.cart_rule.var.replace(".", "_").lower():
-                choices = filter_choices(parent.question.choices, node.cart_rule)
-                labels = [choice.label[f"label::{language}"] for choice in choices]
-                return ", ".join(labels)
+    rule = node.cart_rule
+    if not rule or node.parent.question.type != "calculate":
+        return ""
+
+    parent = node.find_parent(normalize_var(rule.var))
+    if parent:
+        choices = filter_choices(parent.question.choices, rule)
+        column = f"label::{language}"
+        labels = [choice.label[column] for choice in choices]
+        return ", ".join(labels)
 
-    if node.parent.question.type == "calculate" and node.cart_rule:
-        return f"'{node.cart_rule.operator} {node.cart_rule.value}'"
+    # no parent question to get choice labels from: display the raw CART rule
+    return f"'{rule.operator} {rule.value}'"
 
-    return ""
+
+# shape type of form nodes according to their question type
+FORM_SHAPE_TYPES = {
+    "segment": "stadium",
+    "select_one": "rectangle",
+    "select_multiple": "round_edges",
+    "calculate": "parallelogram",
+    "integer": "trapezoid",
+    "decimal": "trapezoid_alt",
+    "text": "circle",
+    "note": "parallelogram_alt",
+}
 
 
 def create_form_diagram(root: Node, *, skip_notes: bool = False) -> str:
     """Create mermaid diagram for typing form."""
     header = "flowchart TD"
 
-    shapes = {
-        "segment": "stadium",
-        "select_one": "rectangle",
-        "select_multiple": "round_edges",
-        "calculate": "parallelogram",
-        "integer": "trapezoid",
-        "decimal": "trapezoid_alt",
-        "text": "circle",
-        "note": "parallelogram_alt",
-    }
-
-    shapes_lst = []
-    links = []
+    # shapes must be declared before links: write them to separate buffers
+    shapes = io.StringIO()
+    shapes.write(header)
+    links = io.StringIO()
+
     for node in root.preorder():
-        if skip_notes and node.question.type == "note":
+        question = node.question
+        if skip_notes and question.type == "note":
             continue
-        shape_type = "circle" if node.name == "segment" else shapes[node.question.type]
+
+        shape_type = "circle" if node.name == "segment" else FORM_SHAPE_TYPES[question.type]
         shape_label = get_form_shape_label(node)
-        shape = draw_shape(node.uid, shape_label, shape_type)
-        shapes_lst.append(shape)
+        shapes.write("\n\t")
+        shapes.write(draw_shape(node.uid, shape_label, shape_type))
 
-        if node.is_root:
+        parent = node.parent
+        if parent is None:
             continue
 
         link_label = get_form_link_label(node)
-        link = draw_link(
-            shape_a=node.parent.question.name, shape_b=node.question.name, label=link_label
+        links.write("\n\t")
+        links.write(
+            draw_link(shape_a=parent.question.name, shape_b=question.name, label=link_label)
         )
-        links.append(link)
 
-    return "\n\t".join([header, *shapes_lst, *links])
+    return shapes.getvalue() + links.getvalue()
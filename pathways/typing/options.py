@@ -1,14 +1,18 @@
 """Apply custom modifications to the form."""
 
-import copy
+from collections import defaultdict
+from itertools import chain
 
 from .tree import Node, Question, create_split_question, update_xpath_variables
 
 
 def apply_calculate_option(
     node: Node, option_config: dict, questions_config: dict, choices_config: dict
-) -> None:
-    """Apply calculate option to form node."""
+) -> Node:
+    """Apply calculate option to form node.
+
+    Returns the node inserted before the source node.
+    """
     new_node = Node(name=option_config["dst_question"])
     new_question = create_split_question(new_node, questions_config, choices_config)
     new_node.question = new_question
@@ -19,12 +23,16 @@ def apply_calculate_option(
     new_node.question.choices_from_parent = node.question.choices_from_parent
     node.question.choices_from_parent = None
     new_node.cart = node.cart
+    return new_node
 
 
 def apply_split_option(
     node: Node, option_config: dict, questions_config: dict, choices_config: dict
-) -> None:
-    """Apply split option to form node."""
+) -> tuple[Node, Node]:
+    """Apply split option to form node.
+
+    Returns the two nodes inserted before the source node.
+    """
     node_a = Node(name=option_config["dst_question_a"])
     node_b = Node(name=option_config["dst_question_b"])
     node.insert_before(node_a)
@@ -35,29 +43,60 @@ def apply_split_option(
     node_a.question = question_a
     node_b.question = question_b
 
-    node.question.type = "calculate"
-    node.question.calculation = update_xpath_variables(node, option_config["calculation"])
-    node_a.question.conditions = node.question.conditions
-    node_b.question.conditions = node.question.conditions
-    node_a.question.choices_from_parent = node.question.choices_from_parent
-    node_b.question.choices_from_parent = node.question.choices_from_parent
-    node.question.choices_from_parent = None
+    question = node.question
+    question.type = "calculate"
+    question.calculation = update_xpath_variables(node, option_config["calculation"])
+    node_a.question.conditions = question.conditions
+    node_b.question.conditions = question.conditions
+    node_a.question.choices_from_parent = question.choices_from_parent
+    node_b.question.choices_from_parent = question.choices_from_parent
+    question.choices_from_parent = None
     node_a.cart = node.cart
     node_b.cart = node.cart
+    return node_a, node_b
 
 
 def apply_options(
-    root: Node, options_config: list[dict], questions_config: dict, choices_config: dict
+    root: Node,
+    options_config: list[dict],
+    questions_config: dict,
+    choices_config: dict,
+    *,
+    inplace: bool = False,
 ) -> Node:
-    """Apply custom options to form tree."""
-    new_root = copy.deepcopy(root)
+    """Apply custom options to form tree.
+
+    The input tree is copied, unless `inplace` is True.
+    """
+    new_root = root if inplace else root.clone()
+
+    # nodes of the tree, indexed by name
+    nodes = defaultdict(list)
+    for node in new_root.preorder():
+        nodes[node.name].append(node)
+
     for option in options_config:
-        for node in new_root.preorder():
-            src_question = option["config"]["src_question"]
-            if option["option"] == "calculate" and node.name == src_question:
-                apply_calculate_option(node, option["config"], questions_config, choices_config)
-            if option["option"] == "split" and node.name == src_question:
-                apply_split_option(node, option["config"], questions_config, choices_config)
+        option_config = option["config"]
+
+        # iterate over a copy: the index is updated with the inserted nodes, which should not be
+        # matched again by the current option
+        src_nodes = list(nodes.get(option_config["src_question"], []))
+
+        if option["option"] == "calculate":
+            for node in src_nodes:
+                new_node = apply_calculate_option(
+                    node, option_config, questions_config, choices_config
+                )
+                nodes[new_node.name].append(new_node)
+
+        elif option["option"] == "split":
+            for node in src_nodes:
+                node_a, node_b = apply_split_option(
+                    node, option_config, questions_config, choices_config
+                )
+                nodes[node_a.name].append(node_a)
+                nodes[node_b.name].append(node_b)
+
     return new_root
 
 
@@ -67,8 +106,8 @@ def add_segment_note(
     """Add note once segment is assigned."""
     segment = node.cart.cluster
     mapping = segments_config.get(node.cart.strata) if segments_config else None
-    if mapping and segment in mapping:
-        segment = mapping[segment]
+    if mapping:
+        segment = mapping.get(segment, segment)
     label = {key: value.format(segment=segment) for key, value in note_label.items()}
 
     new_node = Node(name="segment_note")
@@ -80,10 +119,13 @@ def add_segment_note(
 
 
 def add_segment_notes(
-    root: Node, settings_config: dict, segments_config: dict | None = None
+    root: Node, settings_config: dict, segments_config: dict | None = None, *, inplace: bool = False
 ) -> Node:
-    """Add notes once segments are assigned."""
-    new_root = copy.deepcopy(root)
+    """Add notes once segments are assigned.
+
+    The input tree is copied, unless `inplace` is True.
+    """
+    new_root = root if inplace else root.clone()
     note_label = {
         key.replace("segment_note", "label"): value
         for key, value in settings_config.items()
@@ -95,35 +137,44 @@ def add_segment_notes(
     return new_root
 
 
-def enforce_relevance(root: Node) -> Node:
+def enforce_relevance(root: Node, *, inplace: bool = False) -> Node:
     """Enforce relevance rules for the node.
 
     Instead of considering just the parent for the relevance rule, join relevance rules from all
     parent nodes. This is needed to make sure that the form is behaving correctly when the user
     answers questions and goes backward / change previous responses.
+
+    The input tree is copied, unless `inplace` is True.
     """
-    new_root = copy.deepcopy(root)
+    new_root = root if inplace else root.clone()
+
+    # nodes in preorder, the tree structure is not modified below
+    nodes = list(new_root.preorder())
 
     # use relevance rule from parent by default
-    for node in new_root.preorder():
+    for node in nodes:
         if not node.is_root and not node.question.conditions:
-            node.question.conditions = node.parent.conditions
+            node.question.conditions = list(node.parent.question.conditions or ())
 
     # join relevance rules from all parent nodes
-    for node in new_root.preorder():
+    # nodes are visited in preorder: the rules of the parent node have already been joined with
+    # the rules of its own parents
+    for node in nodes:
         if node.is_root:
             continue
 
-        # parent question answer should not be null
-        node.question.conditions.append(f"${{{node.parent.question.name}}} != ''")
-
-        # all parent relevance rules
-        for parent in node.parents:
-            if parent.question.relevant:
-                node.question.conditions += parent.question.conditions
-
-        # avoid duplicate rules
-        node.question.conditions = list(set(node.question.conditions))
+        # own rules, parent question answer should not be null, and parent relevance rules, without
+        # duplicates (preserving order, so that the generated form is deterministic)
+        parent_question = node.parent.question
+        node.question.conditions = list(
+            dict.fromkeys(
+                chain(
+                    node.question.conditions,
+                    (f"${{{parent_question.name}}} != ''",),
+                    parent_question.conditions or (),
+                )
+            )
+        )
 
     return new_root
 
@@ -133,57 +184,73 @@ def get_choice_filter(node: Node) -> str | None:
     if not node.cart.left.not_present or not node.question.choices:
         return None
 
-    choices = [
-        choice
-        for choice in node.question.choices
-        if choice.cart_value in node.cart.left.not_present
-    ]
+    not_present = set(node.cart.left.not_present)
+    choices = [choice for choice in node.question.choices if choice.cart_value in not_present]
 
     # also remove choice from children list of parent choices
     # nb: this attribute is only used for mermaid generation
+    # choices are not hashable (label is a dict): identify them by list and name
+    removed = {(choice.list_name, choice.name) for choice in choices}
     for child in node.children:
         if child.question.choices_from_parent:
-            for choice in choices:
-                if choice in child.question.choices_from_parent:
-                    child.question.choices_from_parent.remove(choice)
+            child.question.choices_from_parent[:] = [
+                choice
+                for choice in child.question.choices_from_parent
+                if (choice.list_name, choice.name) not in removed
+            ]
 
     return " and ".join([f"name != '{choice.name}'" for choice in choices])
 
 
-def set_choice_filters(root: Node) -> Node:
+def set_choice_filters(root: Node, *, inplace: bool = False) -> Node:
     """Set choice filters for all questions based on CART data.
 
     In the configuration, multiple questions can use the same choice list. This is to avoid
     displaying choices that are not used in the model (for example, because there was no population
     with this categorical value at the split).
+
+    The input tree is copied, unless `inplace` is True.
     """
-    new_root = copy.deepcopy(root)
+    new_root = root if inplace else root.clone()
     for node in new_root.preorder():
         if node.cart and node.question.type.startswith("select"):
             node.question.choice_filter = get_choice_filter(node)
     return new_root
 
 
-def skip_duplicate_questions(root: Node) -> Node:
+def skip_duplicate_questions(root: Node, *, inplace: bool = False) -> Node:
     """Skip questions that have already been asked in parent nodes.
 
     When a question in a node has already been asked in parent nodes, convert it to a `calculate`
     type to use the response of the parent question instead. This is to avoid asking the same
     question twice in the form, even if they refer to different split nodes in the CART.
+
+    The input tree is copied, unless `inplace` is True.
     """
-    new_root = copy.deepcopy(root)
+    new_root = root if inplace else root.clone()
 
-    for node in new_root.preorder():
-        if not node.question or node.is_root:
-            continue
+    # node names already asked along the current path, with the question name of the topmost node
+    # asking it
+    asked = {}
 
-        for parent in node.parents:
-            if not parent.question:
-                continue
+    # depth-first traversal, nodes are pushed a second time to be notified when leaving them
+    stack = [(new_root, True)]
+    while stack:
+        node, entering = stack.pop()
 
-            if node.name == parent.name and not node.name.startswith("segment"):
+        if not entering:
+            del asked[node.name]
+            continue
+
+        if node.question:
+            if node.name not in asked:
+                asked[node.name] = node.question.name
+                stack.append((node, False))
+            elif not node.name.startswith("segment"):
                 node.question.type = "calculate"
                 node.question.choice_list = None
-                node.question.calculation = f"${{{parent.question.name}}}"
+                node.question.calculation = f"${{{asked[node.name]}}}"
+
+        stack.extend((child, True) for child in reversed(node.children))
 
     return new_root
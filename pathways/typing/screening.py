@@ -1,7 +1,12 @@
+REQUIRED_TYPES = frozenset({"select_one", "text", "integer", "decimal"})
+OPTIONAL_TYPES = frozenset({"select_multiple"})
+SELECT_TYPES = frozenset({"select_one", "select_multiple"})
+
+
 def _required(question_type: str) -> str:
-    if question_type in ["select_one", "text", "integer", "decimal"]:
+    if question_type in REQUIRED_TYPES:
         return "TRUE"
-    elif question_type in ["select_multiple"]:
+    elif question_type in OPTIONAL_TYPES:
         return "FALSE"
     else:
         return None
@@ -23,11 +28,21 @@ def add_screening_questions(
     begin = []
     end = []
 
+    # multi-language "required" messages
+    # column for required_message can be either:
+    #   - required_message
+    #   - required_message::English (en)
+    #   - required_message::French (fr)
+    #   - etc
+    required_messages = {
+        key: value for key, value in settings_config.items() if key.startswith("required_message")
+    }
+
     for question in screening_config:
         required = _required(question["type"])
         question_type = question["type"]
 
-        if question_type in ["select_one", "select_multiple"]:
+        if question_type in SELECT_TYPES:
             question_type = f'{question_type} {question["choice_list"]}'
 
         row = {
@@ -38,22 +53,11 @@ def add_screening_questions(
             "required": required,
         }
 
-        # multi-language "required" messages
-        # column for required_message can be either:
-        #   - required_message
-        #   - required_message::English (en)
-        #   - required_message::French (fr)
-        #   - etc
         if required == "TRUE":
-            for key, value in settings_config.items():
-                if key.startswith("required_message"):
-                    row[key] = value
+            row.update(required_messages)
 
-        for label_column in [key for key in question.keys() if key.startswith("label")]:
-            row[label_column] = question[label_column]
-
-        for hint_column in [key for key in question.keys() if key.startswith("hint")]:
-            row[hint_column] = question[hint_column]
+        row.update((key, value) for key, value in question.items() if key.startswith("label"))
+        row.update((key, value) for key, value in question.items() if key.startswith("hint"))
 
         if question["where"] == "begin":
             begin.append(row)
@@ -77,6 +81,10 @@ def add_screening_choices(
     Returns:
         list[dict]: updated choices worksheet
     """
+    # rows already in the worksheet, hashed to avoid comparing each new row with all of them
+    # (column order does not matter, as for dict equality)
+    rows = {frozenset(row.items()) for row in choices_worksheet}
+
     for question in screening_config:
         choice_list = question.get("choice_list")
 
@@ -90,7 +98,9 @@ def add_screening_choices(
                 for label_column, label in choice["label"].items():
                     row[label_column] = label
 
-                if row not in choices_worksheet:
+                key = frozenset(row.items())
+                if key not in rows:
+                    rows.add(key)
                     choices_worksheet.append(row)
 
     return choices_worksheet
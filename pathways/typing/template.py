@@ -13,34 +13,50 @@ These unique values are used to pre-fill the possible answers for each question
 spreadsheet (choice lists).
 """
 
-import polars as pl
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
 import unidecode
 import xlsxwriter
 
+if TYPE_CHECKING:
+    import polars as pl
+
+# translation table replacing non-alphanumeric ASCII characters with underscores
+ASCII_TABLE = {i: "_" for i in range(128) if not chr(i).isalnum()}
+
+# runs of consecutive underscores
+UNDERSCORES = re.compile(r"__+")
+
 
 def get_variables(cart: dict) -> list[str]:
     """Get list of CART variables used as primary splits."""
-    variables = []
-    for node in cart["nodes"]:
-        var = node["var"]
-        if var != "<leaf>" and var not in variables:
-            variables.append(var)
+    variables = {node["var"] for node in cart["nodes"]}
+    variables.discard("<leaf>")
     return sorted(variables)
 
 
 def get_unique_values(df: pl.DataFrame, variables: list[str]) -> dict:
     """Get unique values for all segmentation variables."""
-    unique = {}
-    for var in variables:
-        unique[var] = [v for v in df[var].unique() if v is not None]
-    return unique
+    # polars is only needed here, import it lazily as it is slow to load
+    import polars as pl
+
+    if not variables:
+        return {}
+    # one query for all variables, one sorted list of unique non-null values per column
+    unique = df.select(pl.col(var).drop_nulls().unique().sort().implode() for var in variables)
+    return unique.row(0, named=True)
 
 
 def guess_data_types(unique_values: dict) -> dict:
     """Guess data type of each variable based on their unique values."""
     dtypes = {}
     for var, values in unique_values.items():
-        if sorted(values) == [0, 1]:
+        # binary variables have exactly the values 0 and 1
+        if len(values) == 2 and 0 in values and 1 in values:
             dt = "binary"
         elif all(isinstance(v, int) for v in values):
             dt = "int"
@@ -52,29 +68,32 @@ def guess_data_types(unique_values: dict) -> dict:
     return dtypes
 
 
+@lru_cache(maxsize=4096)
 def to_ascii(src: str) -> str:
     """Convert string to ASCII and replace non-alphanumeric characters with underscores."""
-    src = unidecode.unidecode(src)
-    dst = ""
-
-    for c in src:
-        if c.isalnum():
-            dst += c
-        else:
-            dst += "_"
+    # unidecode is a per-character python loop, skip it for strings that are already ascii
+    if not src.isascii():
+        src = unidecode.unidecode(src)
+    dst = src.translate(ASCII_TABLE)
+    dst = UNDERSCORES.sub("_", dst)
 
-    if dst[0].isnumeric():
+    if dst and dst[0].isnumeric():
         dst = "_" + dst
 
-    dst = dst.strip()
-    dst = dst.lower()
-    return dst.replace("__", "_")
+    return dst.lower()
+
+
+# template languages, with the corresponding label and hint columns
+LANGUAGES = ("English (en)",)
+LABEL_COLUMNS = tuple(f"label::{lang}" for lang in LANGUAGES)
+HINT_COLUMNS = tuple(f"hint::{lang}" for lang in LANGUAGES)
+
+# xlsform question type for each guessed data type
+QUESTION_TYPES = {"binary": "select_one", "str": "select_one", "int": "integer", "float": "decimal"}
 
 
 def questions_worksheet(variables: list[str], dtypes: dict[str, str]) -> list[dict]:
     """Create questions worksheet template from CART variables."""
-    languages = ["English (en)"]
-
     rows = []
 
     for var in sorted(variables):
@@ -87,16 +106,15 @@ def questions_worksheet(variables: list[str], dtypes: dict[str, str]) -> list[di
         row["question_name"] = name
 
         # question labels
-        for lang in languages:
-            row[f"label::{lang}"] = ""
+        for column in LABEL_COLUMNS:
+            row[column] = ""
 
         # question hints
-        for lang in languages:
-            row[f"hint::{lang}"] = ""
+        for column in HINT_COLUMNS:
+            row[column] = ""
 
         # question type
-        qtypes = {"binary": "select_one", "str": "select_one", "int": "integer", "float": "decimal"}
-        qtype = qtypes[dtype]
+        qtype = QUESTION_TYPES[dtype]
         row["question_type"] = qtype
 
         # choice list name, same name as question by default except if binary ("yesno" choice list)
@@ -119,8 +137,6 @@ def choices_worksheet(
     dtypes: dict[str, str],
 ) -> list[dict]:
     """Create choice lists worksheet template from CART variables."""
-    languages = ["English (en)"]
-
     rows = []
 
     # "yesno" choice list for binary variables
@@ -128,8 +144,8 @@ def choices_worksheet(
         row = {}
         row["choice_list"] = "yesno"
         row["name"] = name
-        for lang in languages:
-            row[f"label::{lang}"] = ""
+        for column in LABEL_COLUMNS:
+            row[column] = ""
 
         # binary variables in CART are 0 or 1 integers
         row["target_value"] = str(int(name == "yes"))
@@ -150,8 +166,8 @@ def choices_worksheet(
             row = {}
             row["choice_list"] = var_name
             row["name"] = to_ascii(value)
-            for lang in languages:
-                row[f"label::{lang}"] = ""
+            for column in LABEL_COLUMNS:
+                row[column] = ""
             row["target_value"] = value
             rows.append(row)
 
@@ -178,6 +194,23 @@ DEFAULT_FMT = {
     "font_size": 10,
 }
 
+# height of the description row and width of each column, per worksheet
+SHEET_LAYOUT = {
+    "questions": (120, (40, 50, 50, 30, 40)),
+    "choices": (140, (40, 50, 50, 50)),
+    "options": (50, (50, 100)),
+    "segments": (100, (40, 40, 40)),
+    "settings": (125, (50, 50)),
+}
+
+
+def set_layout(worksheet: xlsxwriter.worksheet.Worksheet) -> None:
+    """Set description row height and column widths of a template worksheet."""
+    height, widths = SHEET_LAYOUT[worksheet.name]
+    worksheet.set_row(0, height)
+    for i, width in enumerate(widths):
+        worksheet.set_column(i, i, width)
+
 
 def write_questions(
     workbook: xlsxwriter.Workbook, variables: list[str], dtypes: dict[str, str]
@@ -217,25 +250,19 @@ def write_questions(
     worksheet.merge_range(0, 0, 0, len(header) - 1, description, cell_format=help_fmt)
     worksheet.write_row(1, 0, header, cell_format=header_fmt)
 
-    row_i = 2
-
-    for row in rows:
-        worksheet.write_row(row_i, 0, list(row.values()), cell_format=default_fmt)
-        row_i += 1
+    write_row = worksheet.write_row
+    for row_i, row in enumerate(rows, start=2):
+        write_row(row_i, 0, row.values(), cell_format=default_fmt)
+    next_row = len(rows) + 2
 
     worksheet.write_row(
-        row_i,
+        next_row,
         0,
         ["location", "Location", "", "select_one", "location"],
         cell_format=default_fmt,
     )
 
-    worksheet.set_row(0, 120)
-    worksheet.set_column(0, 0, 40)
-    worksheet.set_column(1, 1, 50)
-    worksheet.set_column(2, 2, 50)
-    worksheet.set_column(3, 3, 30)
-    worksheet.set_column(4, 4, 40)
+    set_layout(worksheet)
 
 
 def write_choices(
@@ -282,22 +309,19 @@ def write_choices(
     worksheet.merge_range(0, 0, 0, len(header) - 1, description, cell_format=help_fmt)
     worksheet.write_row(1, 0, header, cell_format=header_fmt)
 
-    row_i = 2
-
-    for row in rows:
-        worksheet.write_row(row_i, 0, list(row.values()), cell_format=default_fmt)
-        row_i += 1
+    write_row = worksheet.write_row
+    for row_i, row in enumerate(rows, start=2):
+        write_row(row_i, 0, row.values(), cell_format=default_fmt)
+    next_row = len(rows) + 2
 
-    worksheet.write_row(row_i, 0, ["location", "rural", "Rural", "rural"], cell_format=default_fmt)
     worksheet.write_row(
-        row_i + 1, 0, ["location", "urban", "Urban", "urban"], cell_format=default_fmt
+        next_row, 0, ["location", "rural", "Rural", "rural"], cell_format=default_fmt
+    )
+    worksheet.write_row(
+        next_row + 1, 0, ["location", "urban", "Urban", "urban"], cell_format=default_fmt
     )
 
-    worksheet.set_row(0, 140)
-    worksheet.set_column(0, 0, 40)
-    worksheet.set_column(1, 1, 50)
-    worksheet.set_column(2, 2, 50)
-    worksheet.set_column(3, 3, 50)
+    set_layout(worksheet)
 
 
 def write_options(workbook: xlsxwriter.Workbook) -> None:
@@ -322,9 +346,7 @@ def write_options(workbook: xlsxwriter.Workbook) -> None:
     worksheet.merge_range(0, 0, 0, len(header) - 1, description, cell_format=help_fmt)
     worksheet.write_row(1, 0, header, cell_format=header_fmt)
 
-    worksheet.set_row(0, 50)
-    worksheet.set_column(0, 0, 50)
-    worksheet.set_column(1, 1, 100)
+    set_layout(worksheet)
 
 
 def write_segments(
@@ -370,10 +392,20 @@ def write_segments(
         worksheet.write_row(row_i, 0, ["urban", cluster, ""], cell_format=default_fmt)
         row_i += 1
 
-    worksheet.set_row(0, 100)
-    worksheet.set_column(0, 0, 40)
-    worksheet.set_column(1, 1, 40)
-    worksheet.set_column(2, 2, 40)
+    set_layout(worksheet)
+
+
+# default form settings (key, value)
+FORM_SETTINGS = (
+    ("form_title", "Typing tool"),
+    ("form_id", "pathways_"),
+    ("default_language", "English (en)"),
+    ("allow_form_duplicates", "yes"),
+    ("typing_group_relevant", ""),
+    ("typing_group_label::English (en)", "Typing tool"),
+    ("required_message::English (en)", "Sorry, this response is required!"),
+    ("segment_note::English (en)", "Respondent belongs to segment {segment}."),
+)
 
 
 def write_form_settings(workbook: xlsxwriter.Workbook) -> None:
@@ -405,30 +437,7 @@ def write_form_settings(workbook: xlsxwriter.Workbook) -> None:
     worksheet.merge_range(0, 0, 0, len(header) - 1, description, cell_format=help_fmt)
     worksheet.write_row(1, 0, header, cell_format=header_fmt)
 
-    worksheet.write_row(2, 0, ["form_title", "Typing tool"], cell_format=default_fmt)
-    worksheet.write_row(3, 0, ["form_id", "pathways_"], cell_format=default_fmt)
-    worksheet.write_row(4, 0, ["default_language", "English (en)"], cell_format=default_fmt)
-    worksheet.write_row(5, 0, ["allow_form_duplicates", "yes"], cell_format=default_fmt)
-    worksheet.write_row(6, 0, ["typing_group_relevant", ""], cell_format=default_fmt)
-    worksheet.write_row(
-        7,
-        0,
-        ["typing_group_label::English (en)", "Typing tool"],
-        cell_format=default_fmt,
-    )
-    worksheet.write_row(
-        8,
-        0,
-        ["required_message::English (en)", "Sorry, this response is required!"],
-        cell_format=default_fmt,
-    )
-    worksheet.write_row(
-        9,
-        0,
-        ["segment_note::English (en)", "Respondent belongs to segment {segment}."],
-        cell_format=default_fmt,
-    )
+    for row_i, row in enumerate(FORM_SETTINGS, start=2):
+        worksheet.write_row(row_i, 0, row, cell_format=default_fmt)
 
-    worksheet.set_row(0, 125)
-    worksheet.set_column(0, 0, 50)
-    worksheet.set_column(1, 1, 50)
+    set_layout(worksheet)
@@ -6,19 +6,20 @@ import copy
 import random
 import re
 import string
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
-from math import floor
+from functools import lru_cache
 from typing import TYPE_CHECKING, Literal, Self
 
-from .cart import CARTNode, CARTRule, get_counts, get_probs, get_rules
+from .cart import CARTNode, CARTRule, parse_nodes
 from .exceptions import TypingFormError
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator
+    from collections.abc import Iterable, Iterator
 
 
-@dataclass
+@dataclass(slots=True)
 class Choice:
     """A form question choice."""
 
@@ -39,7 +40,7 @@ class Choice:
         return row
 
 
-@dataclass
+@dataclass(slots=True)
 class ChoiceList:
     """A form choice list."""
 
@@ -63,7 +64,7 @@ QuestionType = Literal[
 Strata = Literal["rural", "urban"]
 
 
-@dataclass
+@dataclass(slots=True)
 class Question:
     """A form question."""
 
@@ -87,42 +88,60 @@ class Question:
             return None
         return " and ".join(f"({condition})" for condition in self.conditions)
 
+    def copy(self) -> Question:
+        """Copy question.
+
+        Lists that are modified while building the form (conditions and choices) are copied. Other
+        attributes, including the choices themselves, are shared with the original question.
+        """
+        return replace(
+            self,
+            conditions=None if self.conditions is None else list(self.conditions),
+            choices=None if self.choices is None else list(self.choices),
+            choices_from_parent=(
+                None if self.choices_from_parent is None else list(self.choices_from_parent)
+            ),
+        )
+
     def to_xlsform(self) -> dict:
         """Convert to xlsform question row."""
-        row = {}
-
         if self.type.startswith("select"):
-            row["type"] = f"{self.type} {self.choice_list}"
+            question_type = f"{self.type} {self.choice_list}"
         else:
-            row["type"] = self.type
-
-        row["name"] = self.name
-
-        if self.label:
-            for column, label in self.label.items():
-                row[column] = label
-
-        if self.hint:
-            for column, hint in self.hint.items():
-                row[column] = hint
-
-        row["calculation"] = self.calculation
-        row["relevant"] = self.relevant
-        row["required"] = self.required
-        row["choice_filter"] = self.choice_filter
+            question_type = self.type
+
+        # single dict display, columns in the same order as the xlsform survey sheet
+        return {
+            "type": question_type,
+            "name": self.name,
+            **(self.label or {}),
+            **(self.hint or {}),
+            "calculation": self.calculation,
+            "relevant": self.relevant,
+            "required": self.required,
+            "choice_filter": self.choice_filter,
+            **(self.required_message or {}),
+        }
+
+
+@lru_cache
+def normalize_var(var: str) -> str:
+    """Convert a CART split variable name to a form question name.
+
+    Split variables are stored in the ed.lev3 format in the rpart output. We want the ed_lev3 format
+    also used in the configuration and as xlsform question names (dots are not supported in xlsform
+    IDs). The same few variables are converted for each node, hence the cache.
+    """
+    return sys.intern(var.replace(".", "_").lower())
 
-        if self.required_message:
-            for column, message in self.required_message.items():
-                row[column] = message
 
-        return row
+UID_CHARS = string.ascii_lowercase + string.digits
+UID_SUFFIX_LENGTH = 6
 
 
 def generate_uid(prefix: str) -> str:
     """Generate uid from node name."""
-    suffix_length = 6
-    chars = string.ascii_lowercase + string.digits
-    suffix = "".join(random.choice(chars) for i in range(suffix_length))  # noqa: S311
+    suffix = "".join(random.choices(UID_CHARS, k=UID_SUFFIX_LENGTH))  # noqa: S311
     name = prefix.lower().replace(".", "_")
     return f"{name}_{suffix}"
 
@@ -130,6 +149,8 @@ def generate_uid(prefix: str) -> str:
 class Node:
     """A node in the typing tree."""
 
+    __slots__ = ("cart", "cart_rule", "children", "name", "parent", "question", "strata", "uid")
+
     def __init__(
         self,
         name: str,
@@ -164,6 +185,22 @@ class Node:
             return None
         return self.parent.children.index(self)
 
+    def clone(self) -> Self:
+        """Copy the subtree rooted at the current node.
+
+        Faster alternative to `copy.deepcopy()`: nodes and questions are copied, but CART data and
+        choices, which are not modified once the tree is built, are shared with the original tree.
+        The copied node has no parent.
+        """
+        node = copy.copy(self)
+        node.parent = None
+        node.children = []
+        if self.question:
+            node.question = self.question.copy()
+        for child in self.children:
+            node.add_child(child.clone())
+        return node
+
     def add_child(self, child: Self) -> None:
         """Add node as child."""
         self.children.append(child)
@@ -188,9 +225,9 @@ class Node:
 
     def insert_before(self, node: Self) -> None:
         """Insert node before current node."""
+        siblings = self.parent.children
+        siblings[siblings.index(self)] = node
         node.parent = self.parent
-        node.parent.children.insert(self.index, node)
-        node.parent.children.remove(self)
         node.children = [self]
         self.parent = node
 
@@ -208,17 +245,45 @@ class Node:
             return None
         return list(self._iter_parents())
 
+    def find_parent(self, name: str) -> Self | None:
+        """Find the closest parent node with the given name.
+
+        Parents are walked up lazily and the search stops at the first match, without building the
+        full list of parent nodes.
+        """
+        node = self.parent
+        while node:
+            if node.name == name:
+                return node
+            node = node.parent
+        return None
+
     def preorder(self) -> Iterator[Self]:
-        """Preorder tree traversal."""
-        yield self
-        for child in self.children:
-            yield from child.preorder()
+        """Preorder tree traversal.
+
+        Iterative traversal with an explicit stack. Children of a node are read after the node has
+        been yielded, so that nodes inserted after it (see `insert_after()`) are also visited.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
     def postorder(self) -> Iterator[Self]:
-        """Postorder tree traversal."""
-        for child in self.children:
-            yield from child.postorder()
-        yield self
+        """Postorder tree traversal.
+
+        Iterative traversal with an explicit stack, see `preorder()`. Nodes are pushed a second
+        time, once their children are on the stack, to be yielded after them.
+        """
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                yield node
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
 
 
 def parse_rpart(
@@ -242,44 +307,8 @@ def parse_rpart(
     dict[int, CARTNode]
         A dict containing all CART nodes, with node binary index as key
     """
-    cart_nodes = {}
-
-    for node in nodes:
-        # the yval2 array from the rpart output contains important information
-        # that might be needed down the road, such as counts, class
-        # probabilities, etc.
-        cluster_name = ylevels[int(node["yval"]) - 1]
-        counts = get_counts(node["yval2"], ylevels)
-        cluster_probabilities = get_probs(node["yval2"], ylevels)
-
-        # rpart uses the "<leaf>" value to indicate that a node doesn't have any
-        # split rule (i.e., it's a leaf)
-        if node["var"] != "<leaf>":
-            left, right = get_rules(
-                var=node["var"],
-                ncat=node["ncat"],
-                index=node["index"],
-                xlevels=xlevels.get(node["var"]),
-                csplit=csplit,
-            )
-
-        else:
-            left, right = None, None
-
-        n = CARTNode(
-            index=int(node["node"]),
-            cluster=cluster_name,
-            counts=counts,
-            cluster_probabilities=cluster_probabilities,
-            node_probability=node["yval2"][-1],
-            left=left,
-            right=right,
-            var=node["var"],
-        )
-
-        cart_nodes[n.index] = n
-
-    return cart_nodes
+    # same parser as for the CART JSON output, which holds these four items as keys
+    return parse_nodes({"nodes": nodes, "ylevels": ylevels, "xlevels": xlevels, "csplit": csplit})
 
 
 def build_tree(cart_nodes: dict[int, CARTNode], strata: Strata) -> Node:
@@ -301,7 +330,7 @@ def build_tree(cart_nodes: dict[int, CARTNode], strata: Strata) -> Node:
     """
     nodes = {}
     for i, node in cart_nodes.items():
-        name = "segment" if node.is_leaf else node.var.replace(".", "_").lower()
+        name = "segment" if node.is_leaf else normalize_var(node.var)
         n = Node(name=name)
         n.strata = node.strata
         n.cart = node
@@ -313,17 +342,13 @@ def build_tree(cart_nodes: dict[int, CARTNode], strata: Strata) -> Node:
         if i == 1:
             continue
 
-        i_parent = floor(i / 2)
-        node.parent = nodes[i_parent]
-        nodes[i_parent].children.append(node)
-
-        # node is a left child
-        if i % 2 == 0:
-            node.cart_rule = nodes[i_parent].cart.left
+        # index of the parent node
+        parent = nodes[i >> 1]
+        node.parent = parent
+        parent.children.append(node)
 
-        # node is a right child
-        elif i % 2 == 1:
-            node.cart_rule = nodes[i_parent].cart.right
+        # node is a left child (even index) or a right child (odd index)
+        node.cart_rule = parent.cart.right if i & 1 else parent.cart.left
 
     return nodes[1]
 
@@ -346,8 +371,8 @@ def merge_trees(root_rural: Node, root_urban: Node) -> Node:
 
     root = Node(name="location")
     root.cart = cart
-    root.add_child(copy.deepcopy(root_rural))
-    root.add_child(copy.deepcopy(root_urban))
+    root.add_child(root_rural.clone())
+    root.add_child(root_urban.clone())
     root.children[0].cart_rule = left_rule
     root.children[1].cart_rule = right_rule
 
@@ -364,18 +389,28 @@ def create_segment_question(node: Node, segments_config: dict | None = None) ->
     segment = node.cart.cluster
 
     mapping = segments_config.get(node.cart.strata) if segments_config else None
-    if mapping and segment in mapping:
-        segment = mapping[segment]
+    if mapping:
+        segment = mapping.get(segment, segment)
 
     return Question(name=node.uid, type="calculate", required=True, calculation=f"'{segment}'")
 
 
 def create_split_question(node: Node, questions_config: dict, choices_config: dict) -> Question:
-    """Create form question for a split node according to config."""
+    """Create form question for a split node according to config.
+
+    All rows of a choice list are expected to have the same columns, as rows read from the choices
+    worksheet do: label columns are taken from the first row of the list.
+    """
     question_config = questions_config[node.name]
 
-    label = {key: value for key, value in question_config.items() if key.startswith("label")}
-    hint = {key: value for key, value in question_config.items() if key.startswith("hint")}
+    # label and hint columns in a single pass over the question config
+    label = {}
+    hint = {}
+    for key, value in question_config.items():
+        if key.startswith("label"):
+            label[key] = value
+        elif key.startswith("hint"):
+            hint[key] = value
 
     question = Question(
         name=node.uid,
@@ -386,17 +421,19 @@ def create_split_question(node: Node, questions_config: dict, choices_config: di
     )
 
     if question.choice_list:
-        choices = []
-        for choice in choices_config[question.choice_list]:
-            choices.append(
-                Choice(
-                    list_name=choice["choice_list"],
-                    name=choice["name"],
-                    label={key: value for key, value in choice.items() if key.startswith("label")},
-                    cart_value=choice.get("target_value"),
-                )
+        rows = choices_config[question.choice_list]
+
+        label_columns = [key for key in rows[0] if key.startswith("label")] if rows else []
+
+        question.choices = [
+            Choice(
+                list_name=choice["choice_list"],
+                name=choice["name"],
+                label={column: choice[column] for column in label_columns},
+                cart_value=choice.get("target_value"),
             )
-        question.choices = choices
+            for choice in rows
+        ]
 
     return question
 
@@ -430,11 +467,21 @@ def xpath_condition(var: str, operator: str, value: str | float) -> str:
     return f"{var} {operator} {value}"
 
 
+# variable name between braces in an xpath expression, e.g. `${ed_lev3}`
+XPATH_VARIABLE = re.compile(r"\{([^}\n]*)\}")
+
+
+@lru_cache(maxsize=1024)
+def _xpath_variables(expression: str) -> tuple[str, ...]:
+    """Unique variables of an xpath expression (the same expressions are reused for many nodes)."""
+    return tuple(dict.fromkeys(XPATH_VARIABLE.findall(expression)))
+
+
 def extract_xpath_variables(expression: str) -> list[str] | None:
     """Extract all variables from an xpath expression."""
-    pattern = r"\{(.*?)\}"
-    matches = re.findall(pattern, expression)
-    return list(set(matches)) if matches else None
+    if "{" not in expression:
+        return None
+    return list(_xpath_variables(expression)) or None
 
 
 def update_xpath_variables(node: Node, expression: str) -> str:
@@ -442,29 +489,27 @@ def update_xpath_variables(node: Node, expression: str) -> str:
 
     Example: ${ed_lev3} -> ${ed_lev3_abc123}
     """
-    variables = extract_xpath_variables(expression)
+    # no variable to replace
+    if "{" not in expression:
+        return expression
+
     mapping = {}
-    for var in variables:
-        uid = None
-        for parent in node.parents:
-            if parent.name == var:
-                uid = parent.uid
-                break
+    for var in _xpath_variables(expression):
+        parent = node.find_parent(var)
+        uid = parent.uid if parent else None
         if not uid:
             msg = f"Variable '{var}' not found in parent nodes."
             raise TypingFormError(msg)
         mapping[var] = "{" + uid + "}"
-    return expression.format(**mapping)
+
+    # replace each variable with the UID of the matching parent node
+    return XPATH_VARIABLE.sub(lambda match: mapping[match.group(1)], expression)
 
 
 def find_cart_parent(node: Node) -> Node:
     """Find the parent node corresponding to the variable in the node CART rule."""
-    var = node.cart_rule.var.replace(".", "_").lower()
-    parent = None
-    for p in node.parents:
-        if p.name == var:
-            parent = p
-            break
+    var = normalize_var(node.cart_rule.var)
+    parent = node.find_parent(var)
     if not parent:
         msg = f"No parent found for variable {var} in node {node.uid}."
         raise TypingFormError(msg)
@@ -473,25 +518,25 @@ def find_cart_parent(node: Node) -> Node:
 
 def filter_choices(choices: list[Choice], cart_rule: CARTRule) -> list[Choice]:
     """Filter input choices based on a CART rule."""
-    filtered = []
+    operator = cart_rule.operator
+    value = cart_rule.value
 
-    if cart_rule.operator in [">", "<"] and not isinstance(cart_rule.value, (int | float)):
-        msg = f"Value {cart_rule.value} is not a number."
+    if operator in (">", "<") and not isinstance(value, (int | float)):
+        msg = f"Value {value} is not a number."
         raise TypingFormError(msg)
 
-    if cart_rule.operator == "in" and not isinstance(cart_rule.value, list):
-        msg = f"Value {cart_rule.value} is not a list."
+    if operator == "in" and not isinstance(value, list):
+        msg = f"Value {value} is not a list."
         raise TypingFormError(msg)
 
-    for choice in choices:
-        if cart_rule.operator == ">" and float(choice.cart_value) > cart_rule.value:
-            filtered.append(choice)
-        if cart_rule.operator == "<" and float(choice.cart_value) < cart_rule.value:
-            filtered.append(choice)
-        if cart_rule.operator == "in" and choice.cart_value in cart_rule.value:
-            filtered.append(choice)
-
-    return filtered
+    if operator == ">":
+        return [choice for choice in choices if float(choice.cart_value) > value]
+    if operator == "<":
+        return [choice for choice in choices if float(choice.cart_value) < value]
+    if operator == "in":
+        values = set(value)
+        return [choice for choice in choices if choice.cart_value in values]
+    return []
 
 
 def get_xlsform_relevance(node: Node) -> str | None:
@@ -519,10 +564,7 @@ def get_xlsform_relevance(node: Node) -> str | None:
         node.question.choices_from_parent = choices
         value = [choice.name for choice in choices]
 
-    # Split variables are stored in the ed.lev3 format in the rpart output
-    # We want the ed_lev3 format also used in the configuration and as xlsform question names
-    # (dots are not supported in xlsform IDs)
-    var = node.cart_rule.var.replace(".", "_").lower()
+    var = normalize_var(node.cart_rule.var)
 
     if isinstance(value, list):
         conditions = [xpath_condition(var, "=", v) for v in value]
@@ -533,12 +575,10 @@ def get_xlsform_relevance(node: Node) -> str | None:
     return update_xpath_variables(node, expression)
 
 
-def get_survey_rows(
-    root: Node, typing_group_label: dict[str, str], typing_group_relevance: str | None = None
-) -> list[dict]:
-    """Generate XLSForm survey sheet rows from typing tree."""
-    rows = []
-
+def _begin_group_row(
+    typing_group_label: dict[str, str], typing_group_relevance: str | None = None
+) -> dict:
+    """Generate XLSForm survey row opening the typing group."""
     begin_group = {
         "type": "begin_group",
         "name": "typing_begin",
@@ -548,41 +588,99 @@ def get_survey_rows(
     for label_column, label in typing_group_label.items():
         begin_group[label_column] = label
 
-    rows.append(begin_group)
+    return begin_group
+
+
+def _end_group_row() -> dict:
+    """Generate XLSForm survey row closing the typing group."""
+    return {"type": "end_group", "name": "typing_end"}
+
+
+def get_survey_rows(
+    root: Node, typing_group_label: dict[str, str], typing_group_relevance: str | None = None
+) -> list[dict]:
+    """Generate XLSForm survey sheet rows from typing tree."""
+    rows = [_begin_group_row(typing_group_label, typing_group_relevance)]
 
     for node in root.preorder():
         if node.question:
             rows.append(node.question.to_xlsform())
 
-    end_group = {"type": "end_group", "name": "typing_end"}
-    rows.append(end_group)
+    rows.append(_end_group_row())
 
     return rows
 
 
+def _append_unique_rows(rows: list[dict], keys: set[frozenset], new_rows: Iterable[dict]) -> None:
+    """Append rows that are not already in the list of rows.
+
+    Rows already added are hashed in `keys` to avoid comparing each new row with all of them
+    (column order does not matter, as for dict equality).
+    """
+    for row in new_rows:
+        key = frozenset(row.items())
+        if key not in keys:
+            keys.add(key)
+            rows.append(row)
+
+
 def get_choices_rows(root: Node) -> list[dict]:
     """Generate XLSForm choices sheet rows from typing tree."""
     rows = []
+    keys = set()
 
     for node in root.preorder():
         if node.question:
             if not node.question.choices:
                 continue
-            for choice in node.question.choices:
-                row = choice.to_xlsform()
-                if row not in rows:
-                    rows.append(row)
+            _append_unique_rows(
+                rows, keys, (choice.to_xlsform() for choice in node.question.choices)
+            )
 
     return rows
 
 
-def get_settings_rows(settings_config: dict) -> list[dict]:
-    """Generate XLSForm settings sheet rows from settings config."""
+def get_form_rows(
+    root: Node, typing_group_label: dict[str, str], typing_group_relevance: str | None = None
+) -> tuple[list[dict], list[dict]]:
+    """Generate XLSForm survey and choices sheet rows from typing tree.
+
+    Same output as `get_survey_rows()` and `get_choices_rows()`, but the tree is only traversed
+    once.
+    """
+    survey_rows = [_begin_group_row(typing_group_label, typing_group_relevance)]
+    choices_rows = []
+    keys = set()
+
+    for node in root.preorder():
+        question = node.question
+        if not question:
+            continue
+
+        survey_rows.append(question.to_xlsform())
+        if question.choices:
+            _append_unique_rows(
+                choices_rows, keys, (choice.to_xlsform() for choice in question.choices)
+            )
+
+    survey_rows.append(_end_group_row())
+
+    return survey_rows, choices_rows
+
+
+def get_settings_rows(settings_config: dict, version: str | None = None) -> list[dict]:
+    """Generate XLSForm settings sheet rows from settings config.
+
+    The form version defaults to the current UTC time (yymmddHHMM).
+    """
+    if version is None:
+        version = datetime.now(timezone.utc).strftime("%y%m%d%H%M")
+
     row = {
         "form_title": settings_config.get("form_title"),
         "form_id": settings_config.get("form_id"),
         "default_language": settings_config.get("default_language"),
         "allow_choice_duplicates": settings_config.get("allow_choice_duplicates"),
-        "version": datetime.now(timezone.utc).strftime("%y%m%d%H%M"),
+        "version": version,
     }
     return [row]